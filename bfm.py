@@ -5,14 +5,17 @@ Build, save, and flash BIOS binaries
 """
 
 import argparse
+import contextlib
+import functools
 import os
 import re
 import shutil
-import subprocess
+import stat
 import sys
-from pathlib import Path
-from typing import Dict, Optional, Any
-import glob
+from typing import TYPE_CHECKING, Dict, Optional, Any, Iterator, Union
+
+if TYPE_CHECKING:
+    import mmap
 
 
 # Set folder locations where repositories and bootlegs are stored
@@ -20,6 +23,20 @@ import glob
 DEV_LOC = r'C:\Users\felixb\BIOS'
 NET_LOC = r'\\wks-file.ftc.rd.hpicorp.net\MAIN_LAB\SHARES\LAB\Brendon Felix\Bootlegs'
 
+# Platform -> (config name, default tree, BiosId.env location relative to HpPlatformPkg)
+PLATFORMS = {
+    'U60': ('Glacier', 'HpWintersWks', os.path.join('MultiProject', 'U60Glacier', 'BLD', 'BiosId.env')),
+    'U61': ('Winters', 'HpWintersWks', os.path.join('MultiProject', 'U61Blizzard', 'BLD', 'BiosId.env')),
+    'U65': ('Avalanche', 'HpAvalancheWks', os.path.join('BLD', 'RSPS', 'BiosId.env')),
+    'X60': ('Springs', 'HpSpringsWks', os.path.join('MultiProject', 'X60Steamboat', 'BLD', 'BiosId.env')),
+}
+
+# Binaries larger than this are memory-mapped instead of read when saving to several folders
+MMAP_THRESHOLD = 128 * 1024 * 1024
+
+# Matches the hex value assigned to VERSION_FEATURE in BiosId.env
+VERSION_RE = re.compile(r'VERSION_FEATURE[^=\n]*=[ \t]*(\S+)')
+
 class Colors:
     RESET = '\033[0m'
     RED = '\033[31m'
@@ -31,17 +48,58 @@ class Colors:
     GREEN_BOLD = '\033[1;32m'
 
 
+def enable_ansi_colors() -> bool:
+    """Check if stdout can display ANSI colors, enabling VT processing on Windows consoles"""
+    if sys.stdout is None or not sys.stdout.isatty() or 'NO_COLOR' in os.environ:
+        return False
+    if os.name != 'nt':
+        return os.environ.get('TERM') != 'dumb'
+    try:
+        import ctypes
+        from ctypes import wintypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.GetStdHandle(-11)  # STD_OUTPUT_HANDLE
+        mode = wintypes.DWORD()
+        if not kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+            return False
+        # ENABLE_VIRTUAL_TERMINAL_PROCESSING
+        return bool(kernel32.SetConsoleMode(handle, mode.value | 0x0004))
+    except (AttributeError, OSError):
+        return False
+
+
+# Disable color codes once at startup if the terminal can't display them
+if not enable_ansi_colors():
+    for color_name in [name for name in vars(Colors) if name.isupper()]:
+        setattr(Colors, color_name, '')
+
+
 def print_colored(text: str, color: str = "") -> None:
     print(f"{color}{text}{Colors.RESET}")
 
 
+@functools.lru_cache(maxsize=256)
+def path_exists(path: str) -> bool:
+    """Cached os.path.exists; clear with path_exists.cache_clear() after creating paths"""
+    return os.path.exists(path)
+
+
+@functools.lru_cache(maxsize=16)
+def find_executable(name: str) -> Optional[str]:
+    """Cached shutil.which"""
+    return shutil.which(name)
+
+
 def check_dpcmd_available() -> None:
-    if shutil.which("dpcmd") is None:
+    if find_executable("dpcmd") is None:
         print_colored("Error: 'dpcmd' command not found in system PATH", Colors.RED_BOLD)
         print_colored("Ensure DediProg SF Software is installed and added to PATH", Colors.RED)
         display = "https://www.dediprog.com/download"
         url = "https://www.dediprog.com/download?productCategory=3&productName=2561&fileType="
-        print_colored(f"Download from: \033]8;;{url}\033\\{display}\033]8;;\033\\ (Ctrl+Click)", Colors.YELLOW)
+        if Colors.RESET:
+            print_colored(f"Download from: \033]8;;{url}\033\\{display}\033]8;;\033\\ (Ctrl+Click)", Colors.YELLOW)
+        else:
+            print_colored(f"Download from: {url}")
         sys.exit(1)
 
 
@@ -56,7 +114,7 @@ def create_config(name: str, tree: Optional[str], default_tree: str, biosid_loc:
     repo_loc = get_repo_loc(tree, default_tree)
     
     # Validate that the repository tree exists
-    if not os.path.exists(repo_loc):
+    if not path_exists(repo_loc):
         tree_name = tree if tree is not None else default_tree
         raise FileNotFoundError(f"Repository tree not found: {repo_loc}")
     
@@ -65,6 +123,7 @@ def create_config(name: str, tree: Optional[str], default_tree: str, biosid_loc:
     return {
         'name': name,
         'repo_loc': repo_loc,
+        'repo_name': os.path.basename(repo_loc),
         'pltpkg_loc': pltpkg_loc,
         'bld_path': os.path.join(pltpkg_loc, 'BLD', 'FV'),
         'bootleg_loc': os.path.join(DEV_LOC, 'Bootlegs', name),
@@ -74,52 +133,29 @@ def create_config(name: str, tree: Optional[str], default_tree: str, biosid_loc:
 
 
 def get_config(platform: Optional[str], tree: Optional[str]) -> Dict[str, str]:
-    if platform == 'U60':
-        return create_config('Glacier', tree, 'HpWintersWks', 'MultiProject/U60Glacier/BLD/BiosId.env')
-    elif platform == 'U61':
-        return create_config('Winters', tree, 'HpWintersWks', 'MultiProject/U61Blizzard/BLD/BiosId.env')
-    elif platform == 'U65':
-        return create_config('Avalanche', tree, 'HpAvalancheWks', 'BLD/RSPS/BiosId.env')
-    elif platform == 'X60' or platform is None:
-        return create_config('Springs', tree, 'HpSpringsWks', 'MultiProject/X60Steamboat/BLD/BiosId.env')
-    else:
+    platform = 'X60' if platform is None else platform
+    if platform not in PLATFORMS:
         raise ValueError(f"Unknown platform: {platform}")
-
-
-def format_hex(value: int, reverse: bool = False) -> str:
-    hex_str = f"{value:02X}"
-    if reverse:
-        return hex_str
-    return hex_str
-
-
-def decode_hex(hex_str: str) -> int:
-    return int(hex_str, 16)
+    name, default_tree, biosid_loc = PLATFORMS[platform]
+    return create_config(name, tree, default_tree, biosid_loc)
 
 
 def set_version(file_path: str, version: Optional[int] = None):
     """Set version in BiosId.env file"""
 
-    if not os.path.exists(file_path):
+    if not path_exists(file_path):
         print_colored(f"BiosId.env file not found at {os.path.basename(file_path)}", Colors.RED)
         raise FileNotFoundError("BiosId.env file not found")
     
     # Read file and find current version
-    with open(file_path, 'r') as f:
-        lines = f.readlines()
-    
-    curr_version_str = None
-    for line in lines:
-        if 'VERSION_FEATURE' in line and '=' in line:
-            match = re.search(r'VERSION_FEATURE.*?=(.+)', line)
-            if match:
-                curr_version_str = match.group(1).strip()
-                break
+    with open(file_path, 'r', newline='') as f:
+        data = f.read()
     
-    if curr_version_str is None:
+    match = VERSION_RE.search(data)
+    if match is None:
         raise ValueError("VERSION_FEATURE not found in BiosId.env")
     
-    curr_version = decode_hex(curr_version_str)
+    curr_version = int(match.group(1), 16)
     
     if version is None:
         new_version = (curr_version - 1) % 100
@@ -128,21 +164,27 @@ def set_version(file_path: str, version: Optional[int] = None):
     
     print_colored(f"Setting feature version {curr_version} → {new_version}", Colors.YELLOW)
     
-    # Update file contents
-    new_lines = []
-    for line in lines:
-        if 'VERSION_FEATURE' in line:
-            new_lines.append(line.replace(curr_version_str, format_hex(new_version, reverse=True)))
-        else:
-            new_lines.append(line)
+    # Splice the new version into the file contents
+    new_data = data[:match.start(1)] + f"{new_version:02X}" + data[match.end(1):]
     
-    with open(file_path, 'w') as f:
-        f.writelines(new_lines)
+    # Write to a temporary file and swap it in so the update is atomic
+    tmp_path = file_path + '.tmp'
+    try:
+        with open(tmp_path, 'w', newline='') as f:
+            f.write(new_data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        # Don't leave the temporary file behind in the source tree
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
 
 
 def build(config: Dict[str, str], release: bool = False) -> None:
     """Build the binary"""
-    os.chdir(config['pltpkg_loc'])
+    import subprocess
     
     command_map = {
         'Glacier': 'HpBldGlacier.bat',
@@ -152,14 +194,16 @@ def build(config: Dict[str, str], release: bool = False) -> None:
     }
     
     command = command_map.get(config['name'], 'HpBldSprings.bat')
+    # Run the batch file through cmd /c directly rather than spawning a shell to parse the command line
+    command_args = ['cmd', '/c', os.path.join(config['pltpkg_loc'], command)]
     
     try:
         if release:
             print_colored("Building RELEASE binary...", Colors.PURPLE)
-            subprocess.run([command, 'r'], check=True, shell=True)
+            subprocess.run(command_args + ['r'], check=True, cwd=config['pltpkg_loc'])
         else:
             print_colored("Building DEBUG binary...", Colors.PURPLE)
-            subprocess.run([command], check=True, shell=True)
+            subprocess.run(command_args, check=True, cwd=config['pltpkg_loc'])
     except subprocess.CalledProcessError:
         print_colored("Build failed", Colors.RED)
         raise RuntimeError("Build failed")
@@ -178,74 +222,113 @@ def check_and_create_directories(config: Dict[str, str], args) -> None:
     if args.output:
         directories_to_check.append(('custom output', args.output))
     
+    # Prompt once per missing directory, then create all accepted directories in one sweep
+    to_create = {}
+    declined = set()
     for dir_type, dir_path in directories_to_check:
-        if not os.path.exists(dir_path):
+        key = os.path.normcase(os.path.normpath(dir_path))
+        if key in to_create or path_exists(dir_path):
+            continue
+        if key not in declined:
             print_colored(f"{dir_type.capitalize()} directory does not exist: {dir_path}", Colors.YELLOW)
             response = input(f"Create {dir_type} directory? (y/N): ").strip().lower()
-            if response not in ('y', 'yes'):
-                print_colored(f"Save to {dir_type} folder will be skipped", Colors.RED)
-                # Remove the corresponding flag so save operation is skipped
-                if dir_type == 'local bootlegs':
-                    args.save = False
-                elif dir_type == 'network bootlegs':
-                    args.network = False
-                elif dir_type == 'custom output':
-                    args.output = None
-            else:
-                try:
-                    os.makedirs(dir_path, exist_ok=True)
-                    print_colored(f"Created {dir_type} directory: {dir_path}", Colors.GREEN)
-                except OSError as e:
-                    print_colored(f"Failed to create {dir_type} directory: {e}", Colors.RED)
-                    raise RuntimeError(f"Could not create {dir_type} directory: {dir_path}")
-
-
-def save_bootleg(bootleg_loc: str, binary_path: str, append: Optional[str] = None) -> None:
-    """Save bootleg to specified location"""
-    # Directory should already exist or have been created earlier
-    if not os.path.exists(bootleg_loc):
-        os.makedirs(bootleg_loc, exist_ok=True)
+            if response in ('y', 'yes'):
+                to_create[key] = (dir_type, dir_path)
+                continue
+            declined.add(key)
+        print_colored(f"Save to {dir_type} folder will be skipped", Colors.RED)
+        # Remove the corresponding flag so save operation is skipped
+        if dir_type == 'local bootlegs':
+            args.save = False
+        elif dir_type == 'network bootlegs':
+            args.network = False
+        elif dir_type == 'custom output':
+            args.output = None
+    
+    # Create shorter paths first so shared parents are only created once
+    for dir_type, dir_path in sorted(to_create.values(), key=lambda item: len(item[1])):
+        try:
+            os.makedirs(dir_path, exist_ok=True)
+            print_colored(f"Created {dir_type} directory: {dir_path}", Colors.GREEN)
+        except OSError as e:
+            print_colored(f"Failed to create {dir_type} directory: {e}", Colors.RED)
+            raise RuntimeError(f"Could not create {dir_type} directory: {dir_path}")
     
+    if to_create:
+        path_exists.cache_clear()
+
+
+@contextlib.contextmanager
+def read_binary_data(path: str) -> Iterator[Union[bytes, 'mmap.mmap']]:
+    """Read a binary once so it can be written to several destinations"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size > MMAP_THRESHOLD:
+            # Map large images rather than holding a private copy in memory
+            import mmap
+            
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                yield data
+        else:
+            yield f.read()
+
+
+def save_bootleg(bootleg_loc: str, binary: Dict[str, Any], append: Optional[str] = None,
+                 data: Optional[Union[bytes, 'mmap.mmap']] = None) -> str:
+    """Save bootleg to specified location and return its basename"""
+    # Directory should already exist or have been created earlier
     if append is None:
-        bootleg_basename = os.path.basename(binary_path)
+        bootleg_basename = binary['basename']
     else:
-        path_obj = Path(binary_path)
-        bootleg_basename = f"{path_obj.stem}_{append}{path_obj.suffix}"
+        stem, suffix = os.path.splitext(binary['basename'])
+        bootleg_basename = f"{stem}_{append}{suffix}"
     
     bootleg_path = os.path.join(bootleg_loc, bootleg_basename)
-    shutil.copy2(binary_path, bootleg_path)
-    print(f"Saved bootleg {Colors.BLUE}{bootleg_basename}{Colors.RESET} to ", end="")
+    if data is None:
+        shutil.copy2(binary['name'], bootleg_path)
+    else:
+        # Contents were already read by the caller, so only write them out
+        with open(bootleg_path, 'wb') as f:
+            f.write(data)
+        shutil.copystat(binary['name'], bootleg_path)
+    return bootleg_basename
+
+
+def is_binary_name(name: str) -> bool:
+    """Check if a file name is a 32/64 bit .bin that isn't a pvt build"""
+    basename = name.lower()
+    return basename.endswith('.bin') and 'pvt' not in basename and ('32' in basename or '64' in basename)
 
 
 def get_binary(path: str) -> Optional[Dict[str, Any]]:
     """Get binary file information"""
     try:
-        if os.path.isdir(path):
-            # Look for .bin files that match pattern
-            pattern = os.path.join(path, "*.bin")
-            files = glob.glob(pattern)
-            # Filter out pvt files and look for 32/64 bit files
-            valid_files = []
-            for f in files:
-                basename = os.path.basename(f).lower()
-                if 'pvt' not in basename and ('32' in basename or '64' in basename):
-                    valid_files.append(f)
+        # A single stat tells us whether path is a folder or a file
+        path_stat = os.stat(path)
+        if stat.S_ISDIR(path_stat.st_mode):
+            # Find the latest .bin file, skipping pvt files and keeping 32/64 bit files
+            latest = None
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if not is_binary_name(entry.name) or not entry.is_file():
+                        continue
+                    entry_stat = entry.stat()
+                    if latest is None or entry_stat.st_mtime > latest[1].st_mtime:
+                        latest = (entry, entry_stat)
             
-            if valid_files:
-                # Sort by modification time and get the latest
-                latest_file = max(valid_files, key=os.path.getmtime)
-                stat = os.stat(latest_file)
+            if latest is not None:
+                latest_entry, file_stat = latest
                 return {
-                    'name': latest_file,
-                    'size': stat.st_size,
-                    'modified': stat.st_mtime
+                    'name': latest_entry.path,
+                    'basename': latest_entry.name,
+                    'size': file_stat.st_size,
+                    'modified': file_stat.st_mtime
                 }
-        elif os.path.isfile(path):
-            stat = os.stat(path)
+        elif stat.S_ISREG(path_stat.st_mode):
             return {
                 'name': path,
-                'size': stat.st_size,
-                'modified': stat.st_mtime
+                'basename': os.path.basename(path),
+                'size': path_stat.st_size,
+                'modified': path_stat.st_mtime
             }
     except (OSError, IOError):
         pass
@@ -261,7 +344,7 @@ def format_filesize(size_bytes: int) -> str:
 
 def print_info(binary: Dict[str, Any]) -> None:
     """Print binary information"""
-    print_colored(os.path.basename(binary['name']), Colors.BLUE)
+    print_colored(binary['basename'], Colors.BLUE)
     print(f"Size: {format_filesize(binary['size'])}")
 
 
@@ -294,6 +377,8 @@ def find_path(path: str) -> Optional[Dict[str, Any]]:
 
 def flash(binary: Dict[str, Any]) -> None:
     """Flash binary using DediProg"""
+    import subprocess
+    
     print_colored("Flashing binary...", Colors.PURPLE)
     try:
         subprocess.run(['dpcmd', '--batch', binary['name'], '--verify'], check=True)
@@ -303,8 +388,8 @@ def flash(binary: Dict[str, Any]) -> None:
         raise RuntimeError("Flash failed")
 
 
-def main():
-    """Main function"""
+def create_parser() -> argparse.ArgumentParser:
+    """Create the command-line argument parser"""
     parser = argparse.ArgumentParser(
         description="Build, save, and flash a bootleg binary",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -365,15 +450,19 @@ Platforms:
                        help="Decrement the feature number")
     parser.add_argument('-v', '--set-version', type=int,
                        help='Set the feature version number directly')
-    
-    args = parser.parse_args()
+    return parser
+
+
+def main():
+    """Main function"""
+    args = create_parser().parse_args()
     
     # Check if dpcmd is available (required for flashing)
     # check_dpcmd_available()
     
     try:
         config = get_config(args.platform, args.tree)
-        print(f"Using config for {Colors.BLUE}{config['name']}{Colors.RESET} with tree {os.path.basename(config['repo_loc'])}")
+        print(f"Using config for {Colors.BLUE}{config['name']}{Colors.RESET} with tree {config['repo_name']}")
         
         # Check and create directories early if save operations are requested
         check_and_create_directories(config, args)
@@ -399,17 +488,31 @@ Platforms:
         if binary is None:
             raise RuntimeError("No binary found")
         
+        destinations = []
         if args.save:
-            save_bootleg(config['bootleg_loc'], binary['name'], args.append)
-            print("local bootlegs folder")
+            destinations.append((config['bootleg_loc'], "local bootlegs folder"))
         
         if args.network:
-            save_bootleg(config['network_loc'], binary['name'], args.append)
-            print("network bootlegs folder")
+            destinations.append((config['network_loc'], "network bootlegs folder"))
         
         if args.output:
-            save_bootleg(args.output, binary['name'], args.append)
-            print(f"custom output folder: {args.output}")
+            destinations.append((args.output, f"custom output folder: {args.output}"))
+        
+        if len(destinations) == 1:
+            bootleg_loc, label = destinations[0]
+            bootleg_basename = save_bootleg(bootleg_loc, binary, args.append)
+            print(f"Saved bootleg {Colors.BLUE}{bootleg_basename}{Colors.RESET} to {label}")
+        elif destinations:
+            # Read the binary once and copy to all destinations concurrently
+            # so slow network copies overlap local ones
+            from concurrent.futures import ThreadPoolExecutor
+            with read_binary_data(binary['name']) as data, \
+                    ThreadPoolExecutor(max_workers=len(destinations)) as executor:
+                futures = [(executor.submit(save_bootleg, loc, binary, args.append, data), label)
+                           for loc, label in destinations]
+                for future, label in futures:
+                    bootleg_basename = future.result()
+                    print(f"Saved bootleg {Colors.BLUE}{bootleg_basename}{Colors.RESET} to {label}")
         
         if args.flash:
             flash(binary)